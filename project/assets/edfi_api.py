@@ -1,9 +1,19 @@
+import hashlib
 import json
+import os
+import re
+import time
 from datetime import datetime
 
-from dagster import AssetKey, MetadataValue, Output, asset
+from dagster import AssetKey, Field, MetadataValue, Output, asset
 
 from assets.edfi_api_endpoints import EDFI_API_ENDPOINTS
+from assets.profiling import StepProfiler
+
+
+EXTRACT_FILE_NAME_PATTERN = re.compile(
+    r"-(?P<min>-?\d+)_(?P<max>-?\d+)-\d{9}-[0-9a-f]{16}\.json$"
+)
 
 
 @asset(
@@ -69,10 +79,160 @@ def change_query_versions(context):
     )
 
 
-def create_edfi_assets():
+def get_extract_file_name(
+    endpoint, slice_min, slice_max, page_number, content_hash
+) -> str:
+    """
+    Build a deterministic file name from the api endpoint,
+    change version slice, page number within the slice and content hash.
+
+    Example value: ed-fi_schools-0_1000-000000001-3f2a9c0d1e4b5a6c.json
+    """
+    endpoint_name = endpoint.strip("/").replace("/", "_")
+    return (
+        f"{endpoint_name}-{slice_min}_{slice_max}-"
+        f"{page_number:09}-{content_hash}.json"
+    )
+
+
+def get_extract_file_window(file_path):
+    """
+    Return the (slice_min, slice_max) change version window of an
+    extract file, or None for files that do not follow get_extract_file_name.
+    """
+    match = EXTRACT_FILE_NAME_PATTERN.search(file_path)
+    if match is None:
+        return None
+
+    return int(match.group("min")), int(match.group("max"))
+
+
+def is_complete_extract_file(file_path):
+    """
+    Return True if the extract file was written by a full pull,
+    i.e. its change version window is -1_-1, and False if it was
+    written by a change query pull.
+
+    Return None for files that do not follow get_extract_file_name.
+    """
+    window = get_extract_file_window(file_path)
+    if window is None:
+        return None
+
+    return window == (-1, -1)
+
+
+def is_within_change_window(
+    file_path, previous_change_version, newest_change_version
+) -> bool:
+    """
+    Return True if the extract file's change version window lies within
+    the passed in window, i.e. a pull of that window replaces the file.
+    Full pulls (-1, -1) only cover files of other full pulls.
+    """
+    window = get_extract_file_window(file_path)
+    if window is None:
+        return False
+    if previous_change_version == -1 and newest_change_version == -1:
+        return window == (-1, -1)
+
+    return window[0] >= previous_change_version and window[1] <= newest_change_version
+
+
+def get_edfi_asset_priorities(instance) -> dict:
+    """
+    Rank edfi api assets by the cost of their previous materialization
+    and return a dict of asset name to dagster/priority tag value.
+
+    Cost is the extract duration in seconds. Assets without a recorded
+    duration (e.g. profiled runs) have their duration estimated from their
+    record count using the average seconds per record of the other assets.
+    Records are only ranked directly if no asset has a duration. Assets
+    without a previous materialization are treated as the most expensive
+    so that new or unknown endpoints are started first. The most expensive
+    asset gets the highest priority, so the multiprocess executor starts
+    the long running assets first and the small descriptor assets fill the gaps.
+    """
+    latest_materializations = instance.get_latest_materialization_events(
+        asset_keys=[
+            AssetKey(("staging", edfi_asset["asset"]))
+            for edfi_asset in EDFI_API_ENDPOINTS
+        ]
+    )
+
+    durations = dict()
+    records = dict()
+    for edfi_asset in EDFI_API_ENDPOINTS:
+        event = latest_materializations.get(AssetKey(("staging", edfi_asset["asset"])))
+        if event is None:
+            continue
+
+        metadata = {
+            metadata_entry.label: metadata_entry.entry_data.value
+            for metadata_entry in event.dagster_event.event_specific_data.materialization.metadata_entries
+        }
+        if "Extract duration (seconds)" in metadata:
+            durations[edfi_asset["asset"]] = metadata["Extract duration (seconds)"]
+        if "Changed records" in metadata:
+            records[edfi_asset["asset"]] = metadata["Changed records"] + metadata.get(
+                "Deleted records", 0
+            )
+
+    # seconds per record across assets with both a duration and record count
+    timed_records = sum(records[name] for name in durations if name in records)
+    if durations and timed_records:
+        seconds_per_record = (
+            sum(durations[name] for name in durations if name in records)
+            / timed_records
+        )
+    elif durations:
+        seconds_per_record = 0
+    else:
+        seconds_per_record = 1
+
+    asset_costs = dict()
+    for edfi_asset in EDFI_API_ENDPOINTS:
+        if edfi_asset["asset"] in durations:
+            asset_costs[edfi_asset["asset"]] = durations[edfi_asset["asset"]]
+        elif edfi_asset["asset"] in records:
+            asset_costs[edfi_asset["asset"]] = (
+                records[edfi_asset["asset"]] * seconds_per_record
+            )
+        else:
+            asset_costs[edfi_asset["asset"]] = float("inf")
+
+    # cheapest asset gets priority 0, most expensive gets the highest value
+    return {
+        asset_name: str(priority)
+        for priority, asset_name in enumerate(
+            sorted(asset_costs, key=lambda asset_name: asset_costs[asset_name])
+        )
+    }
+
+
+def load_edfi_asset_priorities(path) -> dict:
+    """
+    Read asset priorities written by the persist_edfi_asset_priorities
+    sensor. Return an empty dict if the file does not exist yet.
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def create_edfi_assets(asset_priorities=None):
     """
     Generate List of edfi api assets
+
+    Optionally pass in a dict of asset name to priority
+    (see get_edfi_asset_priorities) to set the dagster/priority
+    op tag on each asset. Assets missing from the dict, e.g. new
+    endpoints, get the top priority so they are started first.
     """
+    asset_priorities = asset_priorities or dict()
+    top_priority = str(len(EDFI_API_ENDPOINTS))
     edfi_assets = list()
     for edfi_asset in EDFI_API_ENDPOINTS:
         """
@@ -83,14 +243,12 @@ def create_edfi_assets():
         """
 
         def make_func(edfi_asset):
-            @asset(
-                name=edfi_asset["asset"],
-                group_name="edfi",
-                key_prefix=["staging"],
-                required_resource_keys={"data_lake", "edfi_api_client", "globals"},
-                compute_kind="python",
-            )
-            def extract_and_load(context, change_query_versions):
+            def extract(context, change_query_versions):
+                """
+                Pull each endpoint of the asset from the Ed-Fi API,
+                upload the records to the data lake and
+                return materialization metadata.
+                """
                 school_year = context.resources.globals["school_year"]
                 # change query version numbers
                 previous_change_version = change_query_versions[
@@ -99,10 +257,25 @@ def create_edfi_assets():
                 newest_change_version = change_query_versions["newest_change_version"]
 
                 # dagster run datetime. used in gcs filepath.
+                # use the root run so re-executions write to the same folder
                 stats = context.instance.event_log_storage.get_stats_for_run(
-                    context.run_id
+                    context.dagster_run.root_run_id or context.run_id
                 )
                 launch_datetime = datetime.utcfromtimestamp(stats.launch_time)
+                extract_path = (
+                    f"edfi_api/{edfi_asset['asset']}/school_year={school_year}/"
+                    f"data_model={context.resources.edfi_api_client.data_model}/"
+                    f"date_extracted={launch_datetime}/"
+                )
+
+                # files already uploaded by a previous attempt of this run.
+                # file names are deterministic and end with the content hash,
+                # so an existing name means the same content is already there.
+                existing_files = set(
+                    context.resources.data_lake.list_files(extract_path)
+                )
+                produced_files = set()
+                number_of_skipped_files = 0
 
                 number_of_changed_records = 0
                 changed_records_gcs_paths = []
@@ -120,13 +293,18 @@ def create_edfi_assets():
                         context.log.info(f"Skipping the endpoint {endpoint}")
                         continue
 
-                    file_number = 1
                     # process yielded records from generator
-                    for yielded_response in context.resources.edfi_api_client.get_data(
+                    for (
+                        slice_min,
+                        slice_max,
+                        page_number,
+                        yielded_response,
+                    ) in context.resources.edfi_api_client.get_data(
                         api_endpoint=endpoint,
                         school_year=school_year,
                         previous_change_version=previous_change_version,
                         newest_change_version=newest_change_version,
+                        use_cache=edfi_asset.get("cache_responses", False),
                     ):
 
                         records_to_upload = []
@@ -153,36 +331,123 @@ def create_edfi_assets():
                                 }
                             )
 
-                        # upload current set of records from generator
-                        path = context.resources.data_lake.upload_json(
-                            path=(
-                                f"edfi_api/{edfi_asset['asset']}/school_year={school_year}/"
-                                f"data_model={context.resources.edfi_api_client.data_model}/"
-                                f"date_extracted={launch_datetime}/extract_type={extract_type}/"
-                                f"{abs(hash(endpoint))}-{file_number:09}.json"
-                            ),
-                            records=records_to_upload if records_to_upload else [{}],
+                        json_lines = context.resources.data_lake.to_json_lines(
+                            records_to_upload if records_to_upload else [{}]
+                        )
+                        content_hash = hashlib.sha256(
+                            json_lines.encode("utf-8")
+                        ).hexdigest()[:16]
+                        file_path = (
+                            f"{extract_path}extract_type={extract_type}/"
+                            + get_extract_file_name(
+                                endpoint,
+                                slice_min,
+                                slice_max,
+                                page_number,
+                                content_hash,
+                            )
                         )
+                        produced_files.add(file_path)
+                        if file_path in existing_files:
+                            path = (
+                                f"gs://{context.resources.data_lake.staging_gcs_bucket}/"
+                                f"{file_path}"
+                            )
+                            number_of_skipped_files += 1
+                            context.log.debug(f"Skipping upload, found: {path}")
+                        else:
+                            # upload current set of records from generator
+                            path = context.resources.data_lake.upload_json(
+                                path=file_path, json_lines=json_lines
+                            )
+                            context.log.debug(f"Uploaded records to: {path}")
                         if "/deletes" in endpoint:
                             deleted_records_gcs_paths.append(path)
                         else:
                             changed_records_gcs_paths.append(path)
-                        file_number += 1
-                        context.log.debug(f"Uploaded records to: {path}")
-
-                return Output(
-                    value="Task successful",
-                    metadata={
-                        "Changed records": MetadataValue.int(number_of_changed_records),
-                        "Deleted records": MetadataValue.int(number_of_deleted_records),
-                        "Changed records GCS paths": MetadataValue.text(
-                            ", ".join(changed_records_gcs_paths)
+
+                # remove files from a previous attempt of this run that this
+                # attempt did not produce, e.g. pages whose content has changed,
+                # so the partition holds a single extract. files of other change
+                # windows are kept, e.g. when a re-execution pulls the window
+                # after the original attempt's, which no later run re-pulls
+                for path in existing_files - produced_files:
+                    if not is_within_change_window(
+                        path, previous_change_version, newest_change_version
+                    ):
+                        continue
+                    context.resources.data_lake.delete_files(path)
+                    context.log.debug(f"Removed stale file: {path}")
+
+                metadata = {
+                    "Date extracted": MetadataValue.text(str(launch_datetime)),
+                    "Changed records": MetadataValue.int(number_of_changed_records),
+                    "Deleted records": MetadataValue.int(number_of_deleted_records),
+                    "Skipped uploads": MetadataValue.int(number_of_skipped_files),
+                    "Changed records GCS paths": MetadataValue.text(
+                        ", ".join(changed_records_gcs_paths)
+                    ),
+                    "Deleted records GCS paths": MetadataValue.text(
+                        ", ".join(deleted_records_gcs_paths)
+                    ),
+                }
+                return metadata
+
+            @asset(
+                name=edfi_asset["asset"],
+                group_name="edfi",
+                key_prefix=["staging"],
+                required_resource_keys={"data_lake", "edfi_api_client", "globals"},
+                config_schema={
+                    "profile": Field(
+                        bool,
+                        default_value=False,
+                        is_required=False,
+                        description=(
+                            "Sample stacks and track allocations for this step and "
+                            "write the profile to the run's storage directory."
                         ),
-                        "Deleted records GCS paths": MetadataValue.text(
-                            ", ".join(deleted_records_gcs_paths)
+                    ),
+                },
+                compute_kind="python",
+                op_tags={
+                    "dagster/priority": asset_priorities.get(
+                        edfi_asset["asset"], top_priority
+                    )
+                },
+            )
+            def extract_and_load(context, change_query_versions):
+                start_time = time.monotonic()
+                profiler = None
+                if context.op_config["profile"]:
+                    profiler = StepProfiler(
+                        output_dir=os.path.join(
+                            context.instance.storage_directory(),
+                            context.run_id,
+                            "profiles",
                         ),
-                    },
-                )
+                        name=edfi_asset["asset"],
+                    )
+                    profiler.start()
+
+                # write the profile even if the step fails,
+                # slow failing steps are the ones that need it most
+                try:
+                    metadata = extract(context, change_query_versions)
+                finally:
+                    if profiler:
+                        profile_metadata = profiler.stop()
+
+                if profiler:
+                    # profiling overhead would skew asset priorities,
+                    # so only record the duration of unprofiled runs
+                    metadata.update(profile_metadata)
+                else:
+                    metadata["Extract duration (seconds)"] = MetadataValue.float(
+                        round(time.monotonic() - start_time, 2)
+                    )
+
+                return Output(value="Task successful", metadata=metadata)
 
             return extract_and_load
 
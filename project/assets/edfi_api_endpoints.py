@@ -9,10 +9,12 @@ EDFI_API_ENDPOINTS = [
             "/ed-fi/localEducationAgencies",
             "/ed-fi/localEducationAgencies/deletes",
         ],
+        "cache_responses": True,
     },
     {
         "asset": "base_edfi_calendars",
         "endpoints": ["/ed-fi/calendars", "/ed-fi/calendars/deletes"],
+        "cache_responses": True,
     },
     {
         "asset": "base_edfi_calendar_dates",
@@ -44,6 +46,7 @@ EDFI_API_ENDPOINTS = [
     {
         "asset": "base_edfi_grading_periods",
         "endpoints": ["/ed-fi/gradingPeriods", "/ed-fi/gradingPeriods/deletes"],
+        "cache_responses": True,
     },
     {
         "asset": "base_edfi_grading_period_descriptors",
@@ -51,6 +54,7 @@ EDFI_API_ENDPOINTS = [
             "/ed-fi/gradingPeriodDescriptors",
             "/ed-fi/gradingPeriodDescriptors/deletes",
         ],
+        "cache_responses": True,
     },
     {
         "asset": "base_edfi_objective_assessments",
@@ -66,12 +70,18 @@ EDFI_API_ENDPOINTS = [
     {
         "asset": "base_edfi_programs",
         "endpoints": ["/ed-fi/programs", "/ed-fi/programs/deletes"],
+        "cache_responses": True,
     },
     {
         "asset": "base_edfi_schools",
         "endpoints": ["/ed-fi/schools", "/ed-fi/schools/deletes"],
+        "cache_responses": True,
+    },
+    {
+        "asset": "base_edfi_school_year_types",
+        "endpoints": ["/ed-fi/schoolYearTypes"],
+        "cache_responses": True,
     },
-    {"asset": "base_edfi_school_year_types", "endpoints": ["/ed-fi/schoolYearTypes"]},
     {
         "asset": "base_edfi_sections",
         "endpoints": ["/ed-fi/sections", "/ed-fi/sections/deletes"],
@@ -185,6 +195,7 @@ EDFI_API_ENDPOINTS = [
     {
         "asset": "base_edfi_sessions",
         "endpoints": ["/ed-fi/sessions", "/ed-fi/sessions/deletes"],
+        "cache_responses": True,
     },
     {
         "asset": "base_edfi_descriptors",
@@ -200,5 +211,6 @@ EDFI_API_ENDPOINTS = [
             "/ed-fi/raceDescriptors",
             "/ed-fi/raceDescriptors/deletes",
         ],
+        "cache_responses": True,
     },
 ]
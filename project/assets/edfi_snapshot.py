@@ -0,0 +1,302 @@
+import json
+import re
+
+import pandas as pd
+from dagster import (
+    AssetKey,
+    DagsterEventType,
+    EventRecordsFilter,
+    Field,
+    MetadataValue,
+    Output,
+    asset,
+)
+
+from assets.edfi_api import is_complete_extract_file
+from assets.edfi_api_endpoints import EDFI_API_ENDPOINTS
+
+
+EXTRACT_PATH_PATTERN = re.compile(
+    r"/date_extracted=(?P<date_extracted>[^/]+)/extract_type=(?P<extract_type>records|deletes)/"
+)
+
+SNAPSHOT_COLUMNS = ["id", "date_extracted", "data"]
+
+
+def get_successful_extracts(context, asset_key, after_cursor):
+    """
+    Return the date_extracted partitions of extract materializations
+    recorded after after_cursor, and the cursor of the latest one.
+
+    Materializations from before the Date extracted metadata entry
+    existed fall back to the date_extracted folder in their GCS paths.
+    """
+    dates_extracted = set()
+    cursor = after_cursor
+    for record in context.instance.get_event_records(
+        EventRecordsFilter(
+            event_type=DagsterEventType.ASSET_MATERIALIZATION,
+            asset_key=asset_key,
+            after_cursor=after_cursor,
+        ),
+        ascending=True,
+    ):
+        metadata = {
+            metadata_entry.label: metadata_entry.entry_data.value
+            for metadata_entry in record.event_log_entry.dagster_event.event_specific_data.materialization.metadata_entries
+        }
+        if "Date extracted" in metadata:
+            dates_extracted.add(metadata["Date extracted"])
+        else:
+            for match in EXTRACT_PATH_PATTERN.finditer(
+                metadata.get("Changed records GCS paths", "")
+                + metadata.get("Deleted records GCS paths", "")
+            ):
+                dates_extracted.add(match.group("date_extracted"))
+        cursor = record.storage_id
+
+    return dates_extracted, cursor
+
+
+def is_complete_partition(data_lake, record_paths) -> bool:
+    """
+    Return True if the partition's records were extracted by a full pull.
+    Decided from the file names, so a full pull that returned no records
+    still counts. Files named before get_extract_file_name existed
+    fall back to the is_complete_extract flag of their records.
+    """
+    for path in record_paths:
+        is_complete = is_complete_extract_file(path)
+        if is_complete is not None:
+            return is_complete
+
+    for path in record_paths:
+        for record in data_lake.download_json(path):
+            if "is_complete_extract" in record:
+                return record["is_complete_extract"]
+
+    return False
+
+
+def read_extract_file(data_lake, path, date_extracted) -> pd.DataFrame:
+    """
+    Read an extract file into a dataframe of
+    id, date_extracted and data as a JSON string.
+    """
+    records = [record for record in data_lake.download_json(path) if "id" in record]
+
+    return pd.DataFrame(
+        {
+            "id": [record["id"] for record in records],
+            "date_extracted": date_extracted,
+            "data": [json.dumps(record["data"]) for record in records],
+        },
+        columns=SNAPSHOT_COLUMNS,
+    )
+
+
+def create_edfi_snapshot_assets():
+    """
+    Generate List of assets that compact each edfi api asset's
+    incremental extracts into a current-state snapshot.
+    """
+    snapshot_assets = list()
+    for edfi_asset in EDFI_API_ENDPOINTS:
+
+        def make_func(edfi_asset):
+            @asset(
+                name=f"{edfi_asset['asset']}_snapshot",
+                group_name="edfi",
+                key_prefix=["staging"],
+                non_argument_deps={AssetKey(("staging", edfi_asset["asset"]))},
+                required_resource_keys={"data_lake", "globals"},
+                config_schema={
+                    "rows_per_file": Field(
+                        int,
+                        default_value=1000000,
+                        is_required=False,
+                        description="Max number of rows in each snapshot file.",
+                    ),
+                },
+                compute_kind="python",
+            )
+            def compact(context):
+                """
+                Merge extract partitions into the previous snapshot,
+                keeping the latest version of each id and removing deleted ids,
+                and write the result as parquet files.
+
+                Only partitions whose extract materialized successfully are
+                merged. A manifest stored beside the snapshot records the event
+                log cursor of the last merged extract materialization and the
+                latest complete extract. A partition with a new materialization,
+                including a re-execution into an older partition, is re-merged
+                as a whole, so only partitions from the oldest one with a new
+                materialization onwards are listed.
+                """
+                data_lake = context.resources.data_lake
+                school_year = context.resources.globals["school_year"]
+                data_model = context.resources.globals["data_model"]
+                extract_prefix = (
+                    f"edfi_api/{edfi_asset['asset']}/school_year={school_year}/"
+                    f"data_model={data_model}/"
+                )
+                snapshot_prefix = (
+                    f"edfi_api_snapshot/{edfi_asset['asset']}/school_year={school_year}/"
+                    f"data_model={data_model}/"
+                )
+                manifest_path = f"{snapshot_prefix}manifest.json"
+
+                if data_lake.list_files(manifest_path):
+                    manifest = data_lake.download_json(manifest_path)[0]
+                else:
+                    context.log.info("Did not find previous snapshot manifest")
+                    manifest = {
+                        "event_cursor": None,
+                        "latest_complete_extract": None,
+                        "records": 0,
+                    }
+
+                # partitions before the latest complete extract are superseded
+                previous_cutoff = manifest["latest_complete_extract"] or ""
+                new_successful_extracts, event_cursor = get_successful_extracts(
+                    context,
+                    AssetKey(("staging", edfi_asset["asset"])),
+                    manifest["event_cursor"],
+                )
+                partitions_to_merge = {
+                    date_extracted
+                    for date_extracted in new_successful_extracts
+                    if date_extracted >= previous_cutoff
+                }
+
+                if not partitions_to_merge:
+                    context.log.info("No new extracts to compact")
+                    return Output(
+                        value="Task successful",
+                        metadata={
+                            "Records": MetadataValue.int(manifest["records"]),
+                            "Partitions merged": MetadataValue.int(0),
+                            "Snapshot GCS prefix": MetadataValue.text(snapshot_prefix),
+                        },
+                    )
+
+                # only list partitions from the oldest one being merged onwards
+                partitions = dict()
+                for path in data_lake.list_files(
+                    extract_prefix,
+                    start_offset=(
+                        f"{extract_prefix}date_extracted={min(partitions_to_merge)}"
+                    ),
+                ):
+                    match = EXTRACT_PATH_PATTERN.search(path)
+                    if match is None:
+                        continue
+                    partitions.setdefault(
+                        match.group("date_extracted"), {"records": [], "deletes": []}
+                    )[match.group("extract_type")].append(path)
+                partitions_to_merge &= set(partitions)
+
+                # rows extracted before the latest complete extract are dropped
+                complete_extracts = [
+                    date_extracted
+                    for date_extracted in partitions_to_merge
+                    if is_complete_partition(
+                        data_lake, partitions[date_extracted]["records"]
+                    )
+                ]
+                cutoff = max(complete_extracts + [previous_cutoff]) or None
+                context.log.info(f"Latest complete extract: {cutoff}")
+
+                # load previous snapshot without the partitions being re-merged
+                frames = list()
+                for path in data_lake.list_files(snapshot_prefix):
+                    if path.endswith(".parquet"):
+                        df = data_lake.download_parquet(path)
+                        frames.append(
+                            df[~df["date_extracted"].isin(partitions_to_merge)]
+                        )
+
+                # records of merged partitions are added. deletes of every listed
+                # partition are applied, including extracts that have not
+                # materialized yet, so re-merged records can not come back
+                delete_ids = list()
+                for date_extracted in sorted(partitions):
+                    if cutoff and date_extracted < cutoff:
+                        continue
+                    if date_extracted in partitions_to_merge:
+                        for path in sorted(partitions[date_extracted]["records"]):
+                            frames.append(
+                                read_extract_file(data_lake, path, date_extracted)
+                            )
+                        context.log.debug(f"Merged partition {date_extracted}")
+                    for path in sorted(partitions[date_extracted]["deletes"]):
+                        delete_ids.extend(
+                            read_extract_file(data_lake, path, date_extracted)["id"]
+                        )
+
+                df = pd.concat(
+                    frames or [pd.DataFrame(columns=SNAPSHOT_COLUMNS)],
+                    ignore_index=True,
+                )
+                if cutoff:
+                    df = df[df["date_extracted"] >= cutoff]
+                # keep latest version of each id and remove deleted ids
+                df = (
+                    df.sort_values("date_extracted", kind="stable")
+                    .drop_duplicates(subset="id", keep="last")
+                    .loc[lambda df: ~df["id"].isin(delete_ids)]
+                    .reset_index(drop=True)
+                )
+
+                # overwrite snapshot files and remove any left over parts
+                rows_per_file = context.op_config["rows_per_file"]
+                snapshot_file_names = set()
+                snapshot_paths = list()
+                for file_number, start in enumerate(
+                    range(0, max(len(df), 1), rows_per_file)
+                ):
+                    file_name = f"{snapshot_prefix}part-{file_number:05}.parquet"
+                    snapshot_file_names.add(file_name)
+                    snapshot_paths.append(
+                        data_lake.upload_parquet(
+                            path=file_name,
+                            df=df.iloc[start : start + rows_per_file],
+                        )
+                    )
+                for path in data_lake.list_files(snapshot_prefix):
+                    if path.endswith(".parquet") and path not in snapshot_file_names:
+                        data_lake.delete_files(path)
+
+                # write manifest last so a failed run re-merges its partitions
+                data_lake.upload_json(
+                    path=manifest_path,
+                    records=[
+                        {
+                            "event_cursor": event_cursor,
+                            "latest_complete_extract": cutoff,
+                            "records": len(df),
+                        }
+                    ],
+                )
+
+                return Output(
+                    value="Task successful",
+                    metadata={
+                        "Records": MetadataValue.int(len(df)),
+                        "Partitions merged": MetadataValue.int(
+                            len(partitions_to_merge)
+                        ),
+                        "Latest complete extract": MetadataValue.text(cutoff or ""),
+                        "Snapshot GCS prefix": MetadataValue.text(snapshot_prefix),
+                        "Snapshot GCS paths": MetadataValue.text(
+                            ", ".join(snapshot_paths)
+                        ),
+                    },
+                )
+
+            return compact
+
+        snapshot_assets.append(make_func(edfi_asset))
+
+    return snapshot_assets
@@ -0,0 +1,124 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from dagster import MetadataValue, get_dagster_logger
+
+from resources.edfi_api_resource import SLICE_THREAD_NAME_PREFIX
+
+
+# leaf frames of threads idling on a queue, event or lock
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("threading.py", "join"),
+    ("queue.py", "get"),
+    ("queue.py", "put"),
+}
+
+
+class StepProfiler:
+    """
+    Sampling wall-clock profiler and allocation tracker for a single step.
+
+    A background thread samples the stacks of the thread that started the
+    profiler and of the Ed-Fi API slice workers at a fixed interval and writes
+    the counts in collapsed stack format, which can be loaded into flamegraph
+    tools such as speedscope. Samples of threads idling on a queue, event or
+    lock are dropped, time spent waiting on the API is kept. tracemalloc
+    records the top allocation sites by line.
+    """
+
+    def __init__(self, output_dir, name, interval=0.01, top_allocations=25):
+        self.output_dir = output_dir
+        self.name = name
+        self.interval = interval
+        self.top_allocations = top_allocations
+        self.log = get_dagster_logger()
+        self.stack_counts = Counter()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sampled_thread_ids(self) -> set:
+        return {self._step_thread_id} | {
+            thread.ident
+            for thread in threading.enumerate()
+            if thread.name.startswith(SLICE_THREAD_NAME_PREFIX)
+        }
+
+    def _sample(self):
+        """
+        Record the current stack of the step thread
+        and slice worker threads until stopped.
+        """
+        while not self._stop_event.wait(self.interval):
+            sampled_thread_ids = self._sampled_thread_ids()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in sampled_thread_ids:
+                    continue
+                if (
+                    os.path.basename(frame.f_code.co_filename),
+                    frame.f_code.co_name,
+                ) in IDLE_FRAMES:
+                    continue
+                stack = list()
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                self.stack_counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._step_thread_id = threading.get_ident()
+        tracemalloc.start()
+        self._start_time = time.monotonic()
+        self._thread.start()
+        self.log.info(f"Started profiling {self.name}")
+
+    def stop(self) -> dict:
+        """
+        Stop profiling, write profile files to output_dir
+        and return metadata entries linking to them.
+        """
+        self._stop_event.set()
+        self._thread.join()
+        # leave out allocations made by the sampler itself
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, __file__)]
+        )
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        wall_clock_profile_path = os.path.join(
+            self.output_dir, f"{self.name}.collapsed"
+        )
+        with open(wall_clock_profile_path, "w") as f:
+            for stack, count in self.stack_counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+        allocations_path = os.path.join(self.output_dir, f"{self.name}.allocations.txt")
+        with open(allocations_path, "w") as f:
+            for stat in snapshot.statistics("lineno")[: self.top_allocations]:
+                f.write(f"{stat}\n")
+
+        self.log.info(f"Wrote profile for {self.name} to {self.output_dir}")
+
+        return {
+            "Wall-clock profile": MetadataValue.path(wall_clock_profile_path),
+            "Top allocations": MetadataValue.path(allocations_path),
+            "Wall-clock profile samples": MetadataValue.int(
+                sum(self.stack_counts.values())
+            ),
+            "Peak traced memory (MB)": MetadataValue.float(
+                round(peak_memory / 1024 / 1024, 2)
+            ),
+            "Profiled duration (seconds)": MetadataValue.float(
+                round(time.monotonic() - self._start_time, 2)
+            ),
+        }
@@ -3,7 +3,9 @@ import os
 from assets.edfi_api import (
     change_query_versions,
     create_edfi_assets,
+    load_edfi_asset_priorities,
 )
+from assets.edfi_snapshot import create_edfi_snapshot_assets
 from dagster import (
     Definitions,
     fs_io_manager,
@@ -14,15 +16,21 @@ from dagster_gcp.gcs.io_manager import gcs_pickle_io_manager
 from dagster_gcp.gcs.resources import gcs_resource
 from resources.edfi_api_resource import edfi_api_resource_client
 from resources.gcs_resource import gcs_client
+from sensors.edfi_asset_priorities import (
+    ASSET_PRIORITIES_FILE_NAME,
+    persist_edfi_asset_priorities,
+)
 
 
 SCHOOL_YEAR = 2023
+DATA_MODEL = "3.3.1-b"
 
 
 @resource
 def globals():
     return {
         "school_year": SCHOOL_YEAR,
+        "data_model": DATA_MODEL,
     }
 
 
@@ -39,7 +47,7 @@ RESOURCES_LOCAL = {
             "api_secret": os.getenv("EDFI_API_SECRET"),
             "api_page_limit": 500,
             "api_mode": "Sandbox",  # DistrictSpecific, Sandbox, SharedInstance, YearSpecific
-            "data_model": "3.3.1-b",
+            "data_model": DATA_MODEL,
         }
     ),
     "globals": globals,
@@ -53,10 +61,18 @@ resource_defs_by_deployment_name = {
 
 
 defs = Definitions(
-    assets=([change_query_versions] + create_edfi_assets()),
+    assets=(
+        [change_query_versions]
+        + create_edfi_assets(
+            asset_priorities=load_edfi_asset_priorities(
+                os.path.join(os.getenv("DAGSTER_HOME", ""), ASSET_PRIORITIES_FILE_NAME)
+            )
+        )
+        + create_edfi_snapshot_assets()
+    ),
     schedules=[],
     jobs=[],
-    sensors=[],
+    sensors=[persist_edfi_asset_priorities],
     resources=resource_defs_by_deployment_name[
         os.environ.get("DAGSTER_DEPLOYMENT", "local")
     ],
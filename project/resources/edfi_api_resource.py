@@ -1,17 +1,113 @@
 from typing import List, Dict
 
 import base64
+import hashlib
+import json
+import os
+import queue
 import requests
+import tempfile
+import threading
+import time
 
-from dagster import get_dagster_logger, resource
+from dagster import Field, get_dagster_logger, resource
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 
+# name prefix of the threads that pull change version slices
+SLICE_THREAD_NAME_PREFIX = "edfi-api-slice"
+
+
+class ResponseCache:
+    """
+    On-disk cache of Ed-Fi API responses keyed by URL and token scope.
+    Entries are evicted when older than max_age_days or when the number of
+    entries exceeds max_entries, least recently used first.
+    """
+
+    def __init__(self, cache_dir, max_entries=10000, max_age_days=30):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.log = get_dagster_logger()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.evict()
+
+    def _path(self, key) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @staticmethod
+    def make_key(scope, url) -> str:
+        return hashlib.sha256(f"{scope}|{url}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return cached entry with etag and body keys,
+        or None if there is no usable entry.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            # mark as recently used
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, etag, body):
+        """
+        Atomically write entry so concurrent steps
+        never read a partial file.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"etag": etag, "body": body}, f)
+        os.replace(temp_path, self._path(key))
+
+    def evict(self):
+        """
+        Remove expired entries and trim the cache
+        down to max_entries.
+        """
+        entries = list()
+        for file_name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+
+        expire_before = time.time() - self.max_age_days * 86400
+        entries.sort()
+        number_to_trim = max(len(entries) - self.max_entries, 0)
+        evicted = 0
+        for i, (mtime, path) in enumerate(entries):
+            if i < number_to_trim or mtime < expire_before:
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except OSError:
+                    continue
+
+        if evicted:
+            self.log.debug(f"Evicted {evicted} entries from {self.cache_dir}")
+
+
 class EdFiApiClient:
     """Class for interacting with an Ed-Fi API"""
 
     def __init__(
-        self, base_url, api_key, api_secret, api_page_limit, api_mode, data_model
+        self,
+        base_url,
+        api_key,
+        api_secret,
+        api_page_limit,
+        api_mode,
+        data_model,
+        max_records_per_slice=10000,
+        max_workers=4,
+        response_cache_dir=None,
     ):
         self.base_url = base_url
         self.api_key = api_key
@@ -19,7 +115,13 @@ class EdFiApiClient:
         self.api_page_limit = api_page_limit
         self.api_mode = api_mode
         self.data_model = data_model
+        self.max_records_per_slice = max_records_per_slice
+        self.max_workers = max_workers
         self.log = get_dagster_logger()
+        self.response_cache = (
+            ResponseCache(response_cache_dir) if response_cache_dir else None
+        )
+        self._access_token_lock = threading.Lock()
         self.access_token = self.get_access_token()
 
     def get_access_token(self):
@@ -45,12 +147,29 @@ class EdFiApiClient:
     @retry(
         stop=stop_after_attempt(8), wait=wait_exponential(multiplier=1, min=4, max=10)
     )
-    def _call_api(self, url):
+    def _call_api(self, url, use_cache=False, total_count=False):
         """
         Call GET on passed in URL and
         return response.
+
+        If total_count is set, return the Total-Count response
+        header as an int instead, or None if it is missing.
+
+        If use_cache is set and a response cache is configured,
+        send the cached ETag as If-None-Match and return the
+        cached body when the API responds with 304.
         """
-        headers = {"Authorization": f"Bearer {self.access_token}"}
+        access_token = self.access_token
+        headers = {"Authorization": f"Bearer {access_token}"}
+        cache_key = None
+        cached = None
+        if use_cache and self.response_cache:
+            # api key determines which records the token can see
+            cache_key = ResponseCache.make_key(self.api_key, url)
+            cached = self.response_cache.get(cache_key)
+            if cached:
+                headers["If-None-Match"] = cached["etag"]
+
         try:
             response = requests.get(url, headers=headers)
             response.raise_for_status()
@@ -58,11 +177,32 @@ class EdFiApiClient:
             self.log.warn(f"Failed to retrieve data: {err}")
             self.log.warn(response.reason)
             if response.status_code == 401:
-                self.log.info("Retrieving new access token")
-                self.access_token = self.get_access_token()
+                # slice workers share the token, only refresh
+                # it once if several of them get a 401
+                with self._access_token_lock:
+                    if self.access_token == access_token:
+                        self.log.info("Retrieving new access token")
+                        self.access_token = self.get_access_token()
             raise err
 
-        return response.json()
+        if total_count:
+            if "Total-Count" not in response.headers:
+                return None
+            return int(response.headers["Total-Count"])
+
+        if cache_key is None:
+            return response.json()
+
+        if response.status_code == 304 and cached:
+            self.log.debug(f"Not modified, using cached response for {url}")
+            return cached["body"]
+
+        body = response.json()
+        # without an etag the response can not be revalidated,
+        # so there is nothing to gain from caching it
+        if response.headers.get("ETag"):
+            self.response_cache.set(cache_key, response.headers["ETag"], body)
+        return body
 
     def get_available_change_versions(self, school_year) -> List[Dict]:
         """
@@ -76,38 +216,60 @@ class EdFiApiClient:
 
         return self._call_api(endpoint)
 
-    def get_data(
+    def get_change_version_slices(
         self,
-        api_endpoint: str,
-        school_year: int,
+        resource_url: str,
         previous_change_version: int,
         newest_change_version: int,
-    ) -> List[Dict]:
+    ) -> List[tuple]:
         """
-        Page through API endpoint using change version
-        numbers and return response.
-        """
-        limit = 5000 if "/deletes" in api_endpoint else self.api_page_limit
+        Split change version window into non-overlapping (min, max)
+        sub-ranges holding at most max_records_per_slice records of the
+        resource each. Both ends of a sub-range are inclusive.
 
-        if self.api_mode == "YearSpecific":
-            endpoint = (
-                f"{self.base_url}/data/v3/{school_year}{api_endpoint}" f"?limit={limit}"
+        Change versions are shared by all resources, so record density
+        differs per resource. Windows are counted with totalCount and
+        split into as many equal parts as their count requires, until
+        each part is small enough. Parts without records are dropped.
+        """
+        slices = list()
+        windows = [(previous_change_version, newest_change_version)]
+        while windows:
+            window_min, window_max = windows.pop()
+            count = self._call_api(
+                f"{resource_url}?limit=0&totalCount=true"
+                f"&minChangeVersion={window_min}"
+                f"&maxChangeVersion={window_max}",
+                total_count=True,
             )
-        else:
-            endpoint = f"{self.base_url}/data/v3{api_endpoint}" f"?limit={limit}"
-
-        if previous_change_version > -1 and newest_change_version > -1:
-            endpoint = (
-                f"{endpoint}"
-                f"&minChangeVersion={previous_change_version}"
-                f"&maxChangeVersion={newest_change_version}"
+            if count is None:
+                # total count not supported, pull window as a single slice
+                slices.append((window_min, window_max))
+                continue
+            if count == 0:
+                continue
+            number_of_parts = min(
+                -(-count // self.max_records_per_slice), window_max - window_min + 1
             )
+            if number_of_parts == 1:
+                slices.append((window_min, window_max))
+                continue
+            part_size = -(-(window_max - window_min + 1) // number_of_parts)
+            for part_min in range(window_min, window_max + 1, part_size):
+                windows.append((part_min, min(part_min + part_size - 1, window_max)))
 
+        return sorted(slices)
+
+    def _page_endpoint(self, endpoint: str, limit: int, use_cache=False):
+        """
+        Page through endpoint using offset and
+        yield each page until an empty page is returned.
+        """
         offset = 0
         while True:
             endpoint_to_call = f"{endpoint}&offset={offset}"
             self.log.debug(endpoint_to_call)
-            response = self._call_api(endpoint_to_call)
+            response = self._call_api(endpoint_to_call, use_cache=use_cache)
 
             # yield response allowing records
             # to be stored while continuing to pull
@@ -121,6 +283,137 @@ class EdFiApiClient:
                 # move onto next page
                 offset = offset + limit
 
+    def _page_slices_concurrently(self, endpoint: str, limit: int, slices: List[tuple]):
+        """
+        Page through each change version slice in a pool of
+        worker threads and yield (slice_min, slice_max, page_number, page)
+        tuples of non-empty pages as they arrive. With max_workers set
+        to 1 the slices are pulled one after another.
+        """
+        pages = queue.Queue(maxsize=self.max_workers * 2)
+        slices_to_pull = queue.Queue()
+        for change_version_slice in slices:
+            slices_to_pull.put(change_version_slice)
+        stop_event = threading.Event()
+        done = object()
+
+        def put_page(page):
+            # give up once the consumer has stopped
+            # instead of blocking on a full queue forever
+            while not stop_event.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def worker():
+            try:
+                while not stop_event.is_set():
+                    try:
+                        slice_min, slice_max = slices_to_pull.get_nowait()
+                    except queue.Empty:
+                        break
+                    for page_number, response in enumerate(
+                        self._page_endpoint(
+                            f"{endpoint}"
+                            f"&minChangeVersion={slice_min}"
+                            f"&maxChangeVersion={slice_max}",
+                            limit,
+                        ),
+                        start=1,
+                    ):
+                        if stop_event.is_set():
+                            break
+                        if response:
+                            put_page((slice_min, slice_max, page_number, response))
+            except Exception as err:
+                put_page(err)
+            finally:
+                put_page(done)
+
+        number_of_workers = min(self.max_workers, len(slices))
+        threads = [
+            threading.Thread(
+                target=worker,
+                daemon=True,
+                name=f"{SLICE_THREAD_NAME_PREFIX}-{thread_number}",
+            )
+            for thread_number in range(number_of_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            workers_running = number_of_workers
+            while workers_running:
+                page = pages.get()
+                if page is done:
+                    workers_running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            # stop workers if a worker failed or the caller
+            # stopped consuming pages, e.g. on an upload error
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    def get_data(
+        self,
+        api_endpoint: str,
+        school_year: int,
+        previous_change_version: int,
+        newest_change_version: int,
+        use_cache: bool = False,
+    ) -> List[Dict]:
+        """
+        Page through API endpoint using change version
+        numbers and yield (slice_min, slice_max, page_number, page)
+        tuples. page_number starts at 1 within each slice. Full pulls
+        without change versions use -1 as the slice bounds.
+
+        Change version windows holding more than max_records_per_slice
+        records are split into slices that are pulled concurrently. Only
+        a single empty page, covering the whole window, is yielded at the
+        end of a sliced pull. If use_cache is set, full pulls without
+        change versions are revalidated against the response cache if
+        one is configured.
+        """
+        limit = 5000 if "/deletes" in api_endpoint else self.api_page_limit
+
+        if self.api_mode == "YearSpecific":
+            resource_url = f"{self.base_url}/data/v3/{school_year}{api_endpoint}"
+        else:
+            resource_url = f"{self.base_url}/data/v3{api_endpoint}"
+        endpoint = f"{resource_url}?limit={limit}"
+
+        if previous_change_version > -1 and newest_change_version > -1:
+            slices = self.get_change_version_slices(
+                resource_url, previous_change_version, newest_change_version
+            )
+            if len(slices) > 1:
+                self.log.info(
+                    f"Pulling {api_endpoint} in {len(slices)} change version slices"
+                )
+                yield from self._page_slices_concurrently(endpoint, limit, slices)
+                yield previous_change_version, newest_change_version, 1, []
+                return
+
+            endpoint = (
+                f"{endpoint}"
+                f"&minChangeVersion={previous_change_version}"
+                f"&maxChangeVersion={newest_change_version}"
+            )
+            pages = self._page_endpoint(endpoint, limit)
+        else:
+            pages = self._page_endpoint(endpoint, limit, use_cache=use_cache)
+
+        for page_number, page in enumerate(pages, start=1):
+            yield previous_change_version, newest_change_version, page_number, page
+
     def delete_data(self, id, school_year, api_endpoint) -> str:
         """ """
         headers = {"Authorization": f"Bearer {self.access_token}"}
@@ -176,6 +469,27 @@ class EdFiApiClient:
         "api_page_limit": int,
         "api_mode": str,
         "data_model": str,
+        "max_records_per_slice": Field(
+            int,
+            default_value=10000,
+            is_required=False,
+            description="Max number of records pulled in a single change version slice.",
+        ),
+        "max_workers": Field(
+            int,
+            default_value=4,
+            is_required=False,
+            description="Number of change version slices pulled concurrently.",
+        ),
+        "response_cache_dir": Field(
+            str,
+            is_required=False,
+            description=(
+                "Directory for the on-disk response cache used by full pulls "
+                "of endpoints with cache_responses set. "
+                "Caching is disabled if not set."
+            ),
+        ),
     },
     description="Ed-Fi API client that retrieves data from various endpoints.",
 )
@@ -187,4 +501,7 @@ def edfi_api_resource_client(context):
         context.resource_config["api_page_limit"],
         context.resource_config["api_mode"],
         context.resource_config["data_model"],
+        context.resource_config["max_records_per_slice"],
+        context.resource_config["max_workers"],
+        context.resource_config.get("response_cache_dir"),
     )
@@ -1,6 +1,8 @@
 import csv
+import io
 import json
 import uuid
+from typing import Dict, List
 
 from dagster import get_dagster_logger
 from dagster import resource
@@ -51,26 +53,91 @@ class GcsClient:
 
         return f"gs://{self.staging_gcs_bucket}/{folder_name}/{file_name}"
 
-    def upload_json(self, path, records) -> str:
+    @staticmethod
+    def to_json_lines(records) -> str:
+        """
+        Serialize list of dictionaries
+        as newline delimited JSON.
+        """
+        return "".join(json.dumps(record) + "\r\n" for record in records)
+
+    def upload_json(self, path, records=None, json_lines=None) -> str:
         """
         Upload list of dictionaries to gcs
-        as a JSON file.
+        as a JSON file. Pass json_lines instead of records
+        if the records have already been serialized.
         """
         storage_client = storage.Client()
         bucket = storage_client.get_bucket(self.staging_gcs_bucket)
 
-        output = ""
-        for record in records:
-            output = output + json.dumps(record) + "\r\n"
+        if json_lines is None:
+            json_lines = self.to_json_lines(records)
 
         bucket.blob(path).upload_from_string(
-            output, content_type="application/json", num_retries=3
+            json_lines, content_type="application/json", num_retries=3
         )
         gcs_upload_path = f"gs://{self.staging_gcs_bucket}/{path}"
         self.log.debug(f"Uploaded JSON file to {gcs_upload_path}")
 
         return gcs_upload_path
 
+    def list_files(self, gcs_path, start_offset=None) -> List[str]:
+        """
+        Return names of all files in
+        passed in bucket folder.
+
+        Pass start_offset to only list files whose
+        name sorts at or after start_offset.
+        """
+        storage_client = storage.Client()
+        bucket = storage_client.get_bucket(self.staging_gcs_bucket)
+
+        return [
+            blob.name
+            for blob in bucket.list_blobs(prefix=gcs_path, start_offset=start_offset)
+        ]
+
+    def download_json(self, path) -> List[Dict]:
+        """
+        Download newline delimited JSON file
+        and return list of dictionaries.
+        """
+        storage_client = storage.Client()
+        bucket = storage_client.get_bucket(self.staging_gcs_bucket)
+
+        output = bucket.blob(path).download_as_text()
+
+        return [json.loads(line) for line in output.splitlines() if line.strip()]
+
+    def upload_parquet(self, path, df: pd.DataFrame) -> str:
+        """
+        Upload dataframe to GCS as a
+        parquet file.
+        """
+        storage_client = storage.Client()
+        bucket = storage_client.get_bucket(self.staging_gcs_bucket)
+
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+
+        bucket.blob(path).upload_from_string(
+            buffer.getvalue(), content_type="application/octet-stream", num_retries=3
+        )
+        gcs_upload_path = f"gs://{self.staging_gcs_bucket}/{path}"
+        self.log.debug(f"Uploaded parquet file to {gcs_upload_path}")
+
+        return gcs_upload_path
+
+    def download_parquet(self, path) -> pd.DataFrame:
+        """
+        Download parquet file from
+        GCS and return dataframe.
+        """
+        storage_client = storage.Client()
+        bucket = storage_client.get_bucket(self.staging_gcs_bucket)
+
+        return pd.read_parquet(io.BytesIO(bucket.blob(path).download_as_bytes()))
+
 
 @resource(
     config_schema={
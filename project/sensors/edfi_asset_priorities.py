@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+
+from dagster import (
+    DagsterRunStatus,
+    DefaultSensorStatus,
+    get_dagster_logger,
+    run_status_sensor,
+)
+
+from assets.edfi_api import get_edfi_asset_priorities
+
+
+ASSET_PRIORITIES_FILE_NAME = "edfi_asset_priorities.json"
+
+
+@run_status_sensor(
+    run_status=DagsterRunStatus.SUCCESS,
+    default_status=DefaultSensorStatus.RUNNING,
+    description="Persist Ed-Fi asset priorities after each successful run.",
+)
+def persist_edfi_asset_priorities(context):
+    """
+    Rank edfi api assets by the cost of their latest materialization
+    and write the priorities to the dagster home directory, where they
+    are read when the code location is loaded.
+
+    Each run worker loads the code location when the run launches, so the
+    executor always uses the priorities written after the previous run.
+    The op tags shown in dagit come from the code server and only change
+    once the code location is reloaded.
+    """
+    asset_priorities = get_edfi_asset_priorities(context.instance)
+
+    root_directory = context.instance.root_directory
+    fd, temp_path = tempfile.mkstemp(dir=root_directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(asset_priorities, f)
+    os.replace(temp_path, os.path.join(root_directory, ASSET_PRIORITIES_FILE_NAME))
+
+    get_dagster_logger().info(
+        f"Persisted priorities for {len(asset_priorities)} assets"
+    )